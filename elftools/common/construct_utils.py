@@ -7,9 +7,9 @@
 # This code is in the public domain
 #-------------------------------------------------------------------------------
 from ..construct import (
-    Subconstruct, ConstructError, ArrayError, Adapter, Field, RepeatUntil,
-    Rename
+    Construct, Subconstruct, ConstructError, ArrayError, SizeofError
     )
+from ..construct.core import _read_stream
 
 
 class RepeatUntilExcluding(Subconstruct):
@@ -47,45 +47,57 @@ class RepeatUntilExcluding(Subconstruct):
         raise SizeofError("can't calculate size")
 
 
-def _LEB128_reader():
-    """ Read LEB128 variable-length data from the stream. The data is terminated
-        by a byte with 0 in its highest bit.
-    """
-    return RepeatUntil(
-                lambda obj, ctx: ord(obj) < 0x80,
-                Field(None, 1))
-
+class _ULEB128(Construct):
+    """ A construct for ULEB128, parsed directly from the stream. The data is
+        terminated by a byte with 0 in its highest bit.
 
-class _ULEB128Adapter(Adapter):
-    """ An adapter for ULEB128, given a sequence of bytes in a sub-construct.
+        Only parsing is implemented.
     """
-    def _decode(self, obj, context):
+    __slots__ = []
+    def __init__(self, name):
+        Construct.__init__(self, name)
+        self._set_flag(self.FLAG_DYNAMIC)
+    def _parse(self, stream, context):
         value = 0
-        for b in reversed(obj):
-            value = (value << 7) + (ord(b) & 0x7F)
-        return value
+        shift = 0
+        while True:
+            b = ord(_read_stream(stream, 1))
+            value |= (b & 0x7F) << shift
+            if b < 0x80:
+                return value
+            shift += 7
+    def _build(self, obj, stream, context):
+        raise NotImplementedError('no building')
+    def _sizeof(self, context):
+        raise SizeofError("can't calculate size")
 
 
-class _SLEB128Adapter(Adapter):
-    """ An adapter for SLEB128, given a sequence of bytes in a sub-construct.
+class _SLEB128(_ULEB128):
+    """ A construct for SLEB128, parsed directly from the stream.
     """
-    def _decode(self, obj, context):
+    __slots__ = []
+    def _parse(self, stream, context):
         value = 0
-        for b in reversed(obj):
-            value = (value << 7) + (ord(b) & 0x7F)
-        if ord(obj[-1]) & 0x40:
+        shift = 0
+        while True:
+            b = ord(_read_stream(stream, 1))
+            value |= (b & 0x7F) << shift
+            shift += 7
+            if b < 0x80:
+                break
+        if b & 0x40:
             # negative -> sign extend
-            value |= - (1 << (7 * len(obj)))
+            value |= - (1 << shift)
         return value
 
 
 def ULEB128(name):
     """ A construct creator for ULEB128 encoding.
     """
-    return Rename(name, _ULEB128Adapter(_LEB128_reader()))
+    return _ULEB128(name)
 
 
 def SLEB128(name):
     """ A construct creator for SLEB128 encoding.
     """
-    return Rename(name, _SLEB128Adapter(_LEB128_reader()))
+    return _SLEB128(name)
@@ -7,34 +7,19 @@
 # This code is in the public domain
 #-------------------------------------------------------------------------------
 import io
-import os
+import mmap
 import struct
 import zlib
 
-try:
-    import resource
-    PAGESIZE = resource.getpagesize()
-except ImportError:
-    # Windows system
-    import mmap
-    PAGESIZE = mmap.PAGESIZE
-
-from ..common.py3compat import BytesIO
-from ..common.exceptions import ELFError
+from ..common.py3compat import PY3, BytesIO, byte2int
+from ..common.exceptions import ELFParseError
 from ..common.utils import struct_parse, elf_assert
-from .structs import ELFStructs
 from .sections import (
-        Section, StringTableSection, SymbolTableSection,
-        SUNWSyminfoTableSection, NullSection, NoteSection,
+        Section, StringTableSection, NullSection, NoteSection,
         StabSection, ARMAttributesSection)
-from .dynamic import DynamicSection, DynamicSegment
 from .relocation import RelocationSection, RelocationHandler
-from .gnuversions import (
-        GNUVerNeedSection, GNUVerDefSection,
-        GNUVerSymSection)
-from .segments import Segment, InterpSegment, NoteSegment
+from .segments import Segment
 from ..dwarf.dwarfinfo import DWARFInfo, DebugSectionDescriptor, DwarfConfig
-from ..common.construct_utils import ULEB128, SLEB128
 
 
 class WasmSection:
@@ -53,9 +38,11 @@ class WasmSection:
     DataCount = 12
     Event = 13
 
-    def __init__(self, name, data):
+    def __init__(self, name, data, offset=0):
         self.name = name
         self._data = data
+        # Offset of the data in the file
+        self.offset = offset
         self.header = {
             'sh_size': len(data),
             'sh_offset': 0,
@@ -63,27 +50,114 @@ class WasmSection:
         }
 
     def data(self):
-        return self._data
+        """ The section data as bytes. Internally it is kept as a memoryview
+            into the file buffer, and only copied out when asked for here.
+        """
+        return self._data.tobytes()
 
     def __getitem__(self, name):
         return self.header[name]
 
 
-def read_ULEB128(stream):
-    ret = 0
-    shifts = 0
-    while 1:
-        curr = ord(stream.read(1))
-        ret += (curr & 127) << shifts
-        if not (curr & 128):
-            return ret
+# A ULEB128 encoding of a 64-bit value takes at most 10 bytes
+ULEB128_MAX_SIZE = 10
+
+
+def decode_ULEB128(buf, offset=0):
+    """ Decode a ULEB128 value from the bytes-like object buf, starting at
+        offset. Returns a (value, nbytes) tuple, where nbytes is the size of
+        the encoding.
+    """
+    end = len(buf)
+    if offset >= end:
+        raise ELFParseError('Truncated ULEB128 value at offset %d' % offset)
+    # Most values fit in a single byte
+    first = byte2int(buf[offset])
+    if first < 0x80:
+        return first, 1
+    # Continue the multi-byte value after its first byte
+    ret = first & 0x7f
+    shifts = 7
+    pos = offset + 1
+    while pos < end:
+        curr = byte2int(buf[pos])
+        pos += 1
+        ret |= (curr & 0x7f) << shifts
+        if not (curr & 0x80):
+            return ret, pos - offset
         shifts += 7
+    raise ELFParseError('Truncated ULEB128 value at offset %d' % offset)
+
+
+def read_ULEB128(stream):
+    """ Read a ULEB128 value from the current position of stream.
+
+        Single byte values are returned after reading just that byte. For
+        longer values, enough bytes for the rest of the longest possible
+        encoding are read at once and the stream is then seeked back to the
+        end of the value.
+    """
+    first = stream.read(1)
+    if not first:
+        raise ELFParseError('Truncated ULEB128 value')
+    first = byte2int(first[0])
+    if first < 0x80:
+        return first
+    chunk = stream.read(ULEB128_MAX_SIZE - 1)
+    rest, size = decode_ULEB128(chunk)
+    stream.seek(size - len(chunk), io.SEEK_CUR)
+    return (first & 0x7f) | (rest << 7)
 
 
 def read_WasmString(stream):
     """ Wasm strings are ULEB128 size prefixed """
     size = read_ULEB128(stream)
-    return str(stream.read(size))
+    return stream.read(size).decode('utf-8', 'replace')
+
+
+def scan_sections(buf, pos=8):
+    """ Find the sections of the Wasm module in the bytes-like object buf,
+        starting at offset pos (by default right after the magic number and
+        version). Returns a list of (id, start, size) tuples, where start is
+        the offset of the section contents in buf.
+    """
+    sections = []
+    total = len(buf)
+    while pos < total:
+        # The section id is a single byte; only the size is a ULEB128
+        code = byte2int(buf[pos])
+        size, n = decode_ULEB128(buf, pos + 1)
+        pos += 1 + n
+        sections.append((code, pos, size))
+        pos += size
+    return sections
+
+
+# Section types whose classes are constructed from the header, the name and
+# the file alone. Symbol table, dynamic and GNU versioning sections never
+# appear in Wasm files and are left to the generic Section.
+_SECTION_CLASSES = {
+    'SHT_STRTAB': StringTableSection,
+    'SHT_NULL': NullSection,
+    'SHT_REL': RelocationSection,
+    'SHT_RELA': RelocationSection,
+    'SHT_NOTE': NoteSection,
+    'SHT_ARM_ATTRIBUTES': ARMAttributesSection,
+}
+
+
+# Names of the sections passed to DWARFInfo, in the order get_dwarf_info
+# unpacks them
+_DEBUG_SECTION_NAMES = (
+    '.debug_info', '.debug_aranges', '.debug_abbrev', '.debug_str',
+    '.debug_line', '.debug_frame', '.debug_loc', '.debug_ranges',
+    '.debug_pubtypes', '.debug_pubnames', '.eh_frame')
+
+# The same for files with compressed sections. As it is loaded in the process
+# image, .eh_frame cannot be compressed.
+_ZDEBUG_SECTION_NAMES = tuple(
+    '.z' + name[1:] if name.startswith('.debug_') else name
+    for name in _DEBUG_SECTION_NAMES)
 
 
 class WasmFile(object):
@@ -112,25 +186,68 @@ class WasmFile(object):
 
             e_ident_raw:
                 the raw e_ident field of the header
+
+        When the stream is a real file, it is mapped into memory and the
+        mapping is kept for the lifetime of the WasmFile object and the
+        sections taken from it. On Windows this means the file stays open
+        (and can't be deleted or replaced) until they are garbage collected.
     """
     def __init__(self, stream):
         self.stream = stream
         self._identify_file()
+        self._mm = self._map_file()
         self._read_sections()
 
+    def _map_file(self):
+        """ Return a buffer with the contents of the file: a read-only mapping
+            when the stream is backed by a real file, and the data read from
+            the stream otherwise (e.g. for a BytesIO).
+
+            The sections keep memoryviews into the mapping, so it stays open
+            for as long as this object or any of its sections is alive.
+        """
+        try:
+            fileno = self.stream.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            fileno = None
+        # Python 2 mmap objects don't support the buffer interface memoryview
+        # needs, so the file is read into memory there as well.
+        if fileno is None or not PY3:
+            self.stream.seek(0)
+            return self.stream.read()
+        mapping = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        # The sections are scanned from start to end; let the kernel read
+        # ahead. madvise is only available on Python 3.8+ and POSIX.
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapping.madvise(mmap.MADV_SEQUENTIAL)
+        return mapping
+
     def _read_sections(self):
-        self._section_name_map = {}
-        total = os.fstat(self.stream.fileno()).st_size
-        while self.stream.tell() < total:
-            code = read_ULEB128(self.stream)
-            size = read_ULEB128(self.stream)
-            self._section_name_map.setdefault(code, []).append(self.stream.read(size))
+        """ Walk the sections of the file. The contents of each section are
+            kept as a memoryview into the file buffer, so no data is copied.
+        """
+        # Custom sections are the common case, so they are collected in their
+        # own list; the other (known) sections are grouped by id.
+        user_sections = []
+        self._sections_by_id = {}
+        buf = memoryview(self._mm)
+        for code, start, size in scan_sections(buf):
+            if code == WasmSection.User:
+                user_sections.append((start, buf[start:start + size]))
+            else:
+                self._sections_by_id.setdefault(code, []).append(
+                    buf[start:start + size])
         self._custom_section_name_map = {}
-        for user_section in self._section_name_map[WasmSection.User]:
-            total = len(user_section)
-            stream = io.BytesIO(user_section)
-            name = read_WasmString(stream)
-            self._custom_section_name_map[name] = WasmSection(name, stream.read(total - stream.tell()))
+        for start, user_section in user_sections:
+            # A custom section starts with its name, a ULEB128 size prefixed
+            # string, followed by the payload
+            name_size, n = decode_ULEB128(user_section)
+            # An invalid name shouldn't keep the rest of the file from loading
+            name = user_section[n:n + name_size].tobytes().decode(
+                'utf-8', 'replace')
+            self._custom_section_name_map[name] = WasmSection(
+                name, user_section[n + name_size:], start + n + name_size)
+        self._has_zdebug = '.zdebug_info' in self._custom_section_name_map
 
     def num_sections(self):
         """ Number of sections in the file
@@ -190,9 +307,9 @@ class WasmFile(object):
             We assume that if it has the .debug_info or .zdebug_info section, it
             has all the other required sections as well.
         """
-        return (self.get_section_by_name('.debug_info') or
-            self.get_section_by_name('.zdebug_info') or
-            self.get_section_by_name('.eh_frame'))
+        sections = self._custom_section_name_map
+        return ('.debug_info' in sections or self._has_zdebug or
+            '.eh_frame' in sections)
 
     def get_dwarf_info(self, relocate_dwarf_sections=False):
         """ Return a DWARFInfo object representing the debugging information in
@@ -205,35 +322,31 @@ class WasmFile(object):
         # present.
         # Sections that aren't found will be passed as None to DWARFInfo.
 
-        section_names = ('.debug_info', '.debug_aranges', '.debug_abbrev',
-                         '.debug_str', '.debug_line', '.debug_frame',
-                         '.debug_loc', '.debug_ranges', '.debug_pubtypes', 
-                         '.debug_pubnames')
-
-        compressed = bool(self.get_section_by_name('.zdebug_info'))
+        compressed = self._has_zdebug
         if compressed:
-            section_names = tuple(map(lambda x: '.z' + x[1:], section_names))
-
-        # As it is loaded in the process image, .eh_frame cannot be compressed
-        section_names += ('.eh_frame', )
+            section_names = _ZDEBUG_SECTION_NAMES
+        else:
+            section_names = _DEBUG_SECTION_NAMES
 
         (debug_info_sec_name, debug_aranges_sec_name, debug_abbrev_sec_name,
          debug_str_sec_name, debug_line_sec_name, debug_frame_sec_name,
          debug_loc_sec_name, debug_ranges_sec_name, debug_pubtypes_name,
          debug_pubnames_name, eh_frame_sec_name) = section_names
 
+        sections = self._custom_section_name_map
+        self._prefetch_sections(
+            sections[secname] for secname in section_names
+            if secname in sections)
         debug_sections = {}
         for secname in section_names:
-            section = self.get_section_by_name(secname)
-            if section is None:
-                debug_sections[secname] = None
-            else:
-                dwarf_section = self._read_dwarf_section(
+            section = sections.get(secname)
+            if section is not None:
+                section = self._read_dwarf_section(
                     section,
                     relocate_dwarf_sections)
                 if compressed and secname.startswith('.z'):
-                    dwarf_section = self._decompress_dwarf_section(dwarf_section)
-                debug_sections[secname] = dwarf_section
+                    section = self._decompress_dwarf_section(section)
+            debug_sections[secname] = section
 
         return DWARFInfo(
                 config=DwarfConfig(
@@ -258,6 +371,21 @@ class WasmFile(object):
 
     #-------------------------------- PRIVATE --------------------------------#
 
+    def _prefetch_sections(self, sections):
+        """ Ask the kernel to start paging in the data of the given sections
+            of a mapped file, so that it overlaps with processing them.
+        """
+        if not (isinstance(self._mm, mmap.mmap) and
+                hasattr(mmap, 'MADV_WILLNEED')):
+            return
+        for section in sections:
+            if not section['sh_size']:
+                continue
+            # madvise needs a page aligned start
+            start = section.offset - section.offset % mmap.PAGESIZE
+            self._mm.madvise(mmap.MADV_WILLNEED, start,
+                             section.offset + section['sh_size'] - start)
+
     def __getitem__(self, name):
         """ Implement dict-like access to header entries
         """
@@ -283,17 +411,9 @@ class WasmFile(object):
         return self['e_phoff'] + n * self['e_phentsize']
 
     def _make_segment(self, segment_header):
-        """ Create a Segment object of the appropriate type
+        """ Create a Segment object
         """
-        segtype = segment_header['p_type']
-        if segtype == 'PT_INTERP':
-            return InterpSegment(segment_header, self.stream)
-        elif segtype == 'PT_DYNAMIC':
-            return DynamicSegment(segment_header, self.stream, self)
-        elif segtype == 'PT_NOTE':
-            return NoteSegment(segment_header, self.stream, self)
-        else:
-            return Segment(segment_header, self.stream)
+        return Segment(segment_header, self.stream)
 
     def _get_section_header(self, n):
         """ Find the header of section #n, parse it and return the struct
@@ -316,83 +436,14 @@ class WasmFile(object):
         name = self._get_section_name(section_header)
         sectype = section_header['sh_type']
 
-        if sectype == 'SHT_STRTAB':
-            return StringTableSection(section_header, name, self)
-        elif sectype == 'SHT_NULL':
-            return NullSection(section_header, name, self)
-        elif sectype in ('SHT_SYMTAB', 'SHT_DYNSYM', 'SHT_SUNW_LDYNSYM'):
-            return self._make_symbol_table_section(section_header, name)
-        elif sectype == 'SHT_SUNW_syminfo':
-            return self._make_sunwsyminfo_table_section(section_header, name)
-        elif sectype == 'SHT_GNU_verneed':
-            return self._make_gnu_verneed_section(section_header, name)
-        elif sectype == 'SHT_GNU_verdef':
-            return self._make_gnu_verdef_section(section_header, name)
-        elif sectype == 'SHT_GNU_versym':
-            return self._make_gnu_versym_section(section_header, name)
-        elif sectype in ('SHT_REL', 'SHT_RELA'):
-            return RelocationSection(section_header, name, self)
-        elif sectype == 'SHT_DYNAMIC':
-            return DynamicSection(section_header, name, self)
-        elif sectype == 'SHT_NOTE':
-            return NoteSection(section_header, name, self)
+        section_class = _SECTION_CLASSES.get(sectype)
+        if section_class is not None:
+            return section_class(section_header, name, self)
         elif sectype == 'SHT_PROGBITS' and name == '.stab':
             return StabSection(section_header, name, self)
-        elif sectype == 'SHT_ARM_ATTRIBUTES':
-            return ARMAttributesSection(section_header, name, self)
         else:
             return Section(section_header, name, self)
 
-    def _make_symbol_table_section(self, section_header, name):
-        """ Create a SymbolTableSection
-        """
-        linked_strtab_index = section_header['sh_link']
-        strtab_section = self.get_section(linked_strtab_index)
-        return SymbolTableSection(
-            section_header, name,
-            WasmFile=self,
-            stringtable=strtab_section)
-
-    def _make_sunwsyminfo_table_section(self, section_header, name):
-        """ Create a SUNWSyminfoTableSection
-        """
-        linked_strtab_index = section_header['sh_link']
-        strtab_section = self.get_section(linked_strtab_index)
-        return SUNWSyminfoTableSection(
-            section_header, name,
-            WasmFile=self,
-            symboltable=strtab_section)
-
-    def _make_gnu_verneed_section(self, section_header, name):
-        """ Create a GNUVerNeedSection
-        """
-        linked_strtab_index = section_header['sh_link']
-        strtab_section = self.get_section(linked_strtab_index)
-        return GNUVerNeedSection(
-            section_header, name,
-            WasmFile=self,
-            stringtable=strtab_section)
-
-    def _make_gnu_verdef_section(self, section_header, name):
-        """ Create a GNUVerDefSection
-        """
-        linked_strtab_index = section_header['sh_link']
-        strtab_section = self.get_section(linked_strtab_index)
-        return GNUVerDefSection(
-            section_header, name,
-            WasmFile=self,
-            stringtable=strtab_section)
-
-    def _make_gnu_versym_section(self, section_header, name):
-        """ Create a GNUVerSymSection
-        """
-        linked_strtab_index = section_header['sh_link']
-        strtab_section = self.get_section(linked_strtab_index)
-        return GNUVerSymSection(
-            section_header, name,
-            WasmFile=self,
-            symboltable=strtab_section)
-
     def _get_segment_header(self, n):
         """ Find the header of segment #n, parse it and return the struct
         """
@@ -420,9 +471,10 @@ class WasmFile(object):
         """ Read the contents of a DWARF section from the stream and return a
             DebugSectionDescriptor. Apply relocations if asked to.
         """
-        # The section data is read into a new stream, for processing
-        section_stream = BytesIO()
-        section_stream.write(section.data())
+        # The section data is wrapped in a stream for processing. A BytesIO
+        # initialized from the data is still writable, so relocations can be
+        # applied to it in place.
+        section_stream = BytesIO(section.data())
 
         if relocate_dwarf_sections:
             reloc_handler = RelocationHandler(self)
@@ -455,20 +507,19 @@ class WasmFile(object):
 
         uncompressed_size = struct.unpack('>Q', section.stream.read(8))[0]
 
-        decompressor = zlib.decompressobj()
-        uncompressed_stream = BytesIO()
-        while True:
-            chunk = section.stream.read(PAGESIZE)
-            if not chunk:
-                break
-            uncompressed_stream.write(decompressor.decompress(chunk))
-        uncompressed_stream.write(decompressor.flush())
-
-        uncompressed_stream.seek(0, io.SEEK_END)
-        size = uncompressed_stream.tell()
+        # The compressed data is already in memory, so decompress it in one
+        # go into a buffer of the expected size. The size comes from the file,
+        # so it is capped at what the compressed data can expand to (deflate
+        # can't exceed 1032:1); a wrong size is reported below.
+        compressed = section.stream.read()
+        uncompressed = zlib.decompress(
+            compressed, zlib.MAX_WBITS,
+            min(uncompressed_size, 1032 * len(compressed)))
+
+        size = len(uncompressed)
         assert uncompressed_size == size, \
                 'Wrong uncompressed size: expected %r, but got %r' % (
                     uncompressed_size, size,
                 )
 
-        return section._replace(stream=uncompressed_stream, size=size)
+        return section._replace(stream=BytesIO(uncompressed), size=size)
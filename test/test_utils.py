@@ -10,6 +10,8 @@ from random import randint
 from elftools.common.py3compat import int2byte, BytesIO
 from elftools.common.utils import (parse_cstring_from_stream, merge_dicts,
         preserve_stream_pos)
+from elftools.common.construct_utils import ULEB128, SLEB128
+from elftools.construct import ConstructError
 
 
 class Test_parse_cstring_from_stream(unittest.TestCase):
@@ -64,5 +66,29 @@ class Test_merge_dicts(unittest.TestCase):
         self.assertEqual(md, {10: 20, 20: 40, 50: 60})
 
 
+class Test_LEB128(unittest.TestCase):
+    def test_uleb128(self):
+        sio = BytesIO(b'\x02\x7f\x80\x01\xe5\x8e\x26')
+        uleb = ULEB128('x')
+        self.assertEqual(uleb.parse_stream(sio), 2)
+        self.assertEqual(uleb.parse_stream(sio), 127)
+        self.assertEqual(uleb.parse_stream(sio), 128)
+        self.assertEqual(uleb.parse_stream(sio), 624485)
+        self.assertEqual(sio.tell(), 7)
+
+    def test_sleb128(self):
+        sio = BytesIO(b'\x02\x7e\xff\x00\x81\x7f\xc0\xbb\x78')
+        sleb = SLEB128('x')
+        self.assertEqual(sleb.parse_stream(sio), 2)
+        self.assertEqual(sleb.parse_stream(sio), -2)
+        self.assertEqual(sleb.parse_stream(sio), 127)
+        self.assertEqual(sleb.parse_stream(sio), -127)
+        self.assertEqual(sleb.parse_stream(sio), -123456)
+
+    def test_truncated(self):
+        self.assertRaises(ConstructError, ULEB128('x').parse, b'\x80\x80')
+        self.assertRaises(ConstructError, SLEB128('x').parse, b'')
+
+
 if __name__ == '__main__':
     unittest.main()
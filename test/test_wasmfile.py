@@ -0,0 +1,192 @@
+#-------------------------------------------------------------------------------
+# elftools tests
+#
+# Eli Bendersky (eliben@gmail.com)
+# This code is in the public domain
+#-------------------------------------------------------------------------------
+import struct
+import tempfile
+import unittest
+import zlib
+
+from elftools.common.py3compat import BytesIO, int2byte
+from elftools.common.exceptions import ELFParseError
+from elftools.dwarf.dwarfinfo import DebugSectionDescriptor
+from elftools.elf.wasmfile import (WasmFile, decode_ULEB128, read_ULEB128,
+        read_WasmString, scan_sections)
+
+
+def _encode_ULEB128(value):
+    out = []
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(int2byte(byte | 0x80))
+        else:
+            out.append(int2byte(byte))
+            return b''.join(out)
+
+
+def _make_section(code, payload):
+    return _encode_ULEB128(code) + _encode_ULEB128(len(payload)) + payload
+
+
+def _make_custom_section(name, payload):
+    name = name.encode('utf-8')
+    return _make_section(0, _encode_ULEB128(len(name)) + name + payload)
+
+
+def _make_module(*sections):
+    return b'\x00asm\x01\x00\x00\x00' + b''.join(sections)
+
+
+class TestULEB128(unittest.TestCase):
+    def test_decode(self):
+        self.assertEqual(decode_ULEB128(b'\x02'), (2, 1))
+        self.assertEqual(decode_ULEB128(b'\x7f'), (127, 1))
+        self.assertEqual(decode_ULEB128(b'\x80\x01'), (128, 2))
+        self.assertEqual(decode_ULEB128(b'\xe5\x8e\x26'), (624485, 3))
+        self.assertEqual(decode_ULEB128(b'\xff' * 9 + b'\x01'),
+                         (2 ** 64 - 1, 10))
+
+    def test_decode_offset(self):
+        self.assertEqual(decode_ULEB128(b'\xff\xe5\x8e\x26\x00', 1),
+                         (624485, 3))
+
+    def test_decode_truncated(self):
+        with self.assertRaises(ELFParseError):
+            decode_ULEB128(b'\x80\x80')
+
+    def test_read(self):
+        stream = BytesIO(b'\x02\xe5\x8e\x26\x7f')
+        self.assertEqual(read_ULEB128(stream), 2)
+        self.assertEqual(stream.tell(), 1)
+        self.assertEqual(read_ULEB128(stream), 624485)
+        self.assertEqual(stream.tell(), 4)
+        self.assertEqual(read_ULEB128(stream), 127)
+        self.assertEqual(stream.tell(), 5)
+
+    def test_read_long(self):
+        stream = BytesIO(b'\xff' * 9 + b'\x01\x05')
+        self.assertEqual(read_ULEB128(stream), 2 ** 64 - 1)
+        self.assertEqual(stream.tell(), 10)
+        self.assertEqual(read_ULEB128(stream), 5)
+
+    def test_read_truncated(self):
+        with self.assertRaises(ELFParseError):
+            read_ULEB128(BytesIO(b''))
+        with self.assertRaises(ELFParseError):
+            read_ULEB128(BytesIO(b'\x80\x80'))
+
+    def test_read_string(self):
+        stream = BytesIO(b'\x05hello\x00')
+        self.assertEqual(read_WasmString(stream), 'hello')
+        self.assertEqual(stream.tell(), 6)
+
+
+class TestWasmSections(unittest.TestCase):
+    def test_scan_sections(self):
+        module = _make_module(
+            _make_section(1, b'\x60\x00\x00'),
+            _make_custom_section('name', b'x' * 200),
+            _make_section(10, b''))
+        self.assertEqual(scan_sections(module),
+                         [(1, 10, 3), (0, 16, 205), (10, 223, 0)])
+
+    def test_custom_sections(self):
+        wasm = WasmFile(BytesIO(_make_module(
+            _make_section(1, b'\x60\x00\x00'),
+            _make_custom_section('.debug_info', b'\x01\x02\x03'),
+            _make_custom_section('name', b'x' * 200))))
+        section = wasm.get_section_by_name('.debug_info')
+        self.assertEqual(section.name, '.debug_info')
+        self.assertEqual(section.data(), b'\x01\x02\x03')
+        self.assertEqual(section['sh_size'], 3)
+        self.assertEqual(wasm.get_section_by_name('name').data(),
+                         b'x' * 200)
+        self.assertIsNone(wasm.get_section_by_name('.debug_line'))
+        self.assertTrue(wasm.has_dwarf_info())
+
+    def test_invalid_section_name(self):
+        wasm = WasmFile(BytesIO(_make_module(
+            _make_section(0, b'\x02\xff\xfe\x01'),
+            _make_custom_section('.debug_info', b'\x01'))))
+        self.assertEqual(wasm.get_section_by_name(u'\ufffd\ufffd').data(),
+                         b'\x01')
+        self.assertEqual(wasm.get_section_by_name('.debug_info').data(),
+                         b'\x01')
+
+    def test_no_custom_sections(self):
+        wasm = WasmFile(BytesIO(_make_module(
+            _make_section(1, b'\x60\x00\x00'))))
+        self.assertIsNone(wasm.get_section_by_name('.debug_info'))
+        self.assertFalse(wasm.has_dwarf_info())
+
+    def test_dwarf_sections(self):
+        wasm = WasmFile(BytesIO(_make_module(
+            _make_custom_section('.debug_info', b'\x01'),
+            _make_custom_section('.debug_str', b'abc\x00'))))
+        dwarfinfo = wasm.get_dwarf_info()
+        self.assertEqual(dwarfinfo.debug_info_sec.name, '.debug_info')
+        self.assertEqual(dwarfinfo.debug_str_sec.stream.read(), b'abc\x00')
+        self.assertIsNone(dwarfinfo.debug_line_sec)
+
+    def test_compressed_dwarf_sections(self):
+        def compress(data):
+            return b'ZLIB' + struct.pack('>Q', len(data)) + zlib.compress(data)
+        wasm = WasmFile(BytesIO(_make_module(
+            _make_custom_section('.zdebug_info', compress(b'\x01')),
+            _make_custom_section('.zdebug_str', compress(b'abc\x00')))))
+        self.assertTrue(wasm.has_dwarf_info())
+        dwarfinfo = wasm.get_dwarf_info()
+        self.assertEqual(dwarfinfo.debug_info_sec.name, '.zdebug_info')
+        self.assertEqual(dwarfinfo.debug_str_sec.size, 4)
+        self.assertEqual(dwarfinfo.debug_str_sec.stream.read(), b'abc\x00')
+        self.assertIsNone(dwarfinfo.debug_line_sec)
+
+    def test_real_file(self):
+        with tempfile.TemporaryFile() as stream:
+            stream.write(_make_module(
+                _make_custom_section('.debug_info', b''),
+                _make_custom_section('.debug_abbrev', b'\x00')))
+            stream.flush()
+            wasm = WasmFile(stream)
+            section = wasm.get_section_by_name('.debug_abbrev')
+            self.assertEqual(section.data(), b'\x00')
+            self.assertEqual(section.offset, 38)
+            dwarfinfo = wasm.get_dwarf_info()
+            self.assertEqual(dwarfinfo.debug_abbrev_sec.stream.read(),
+                             b'\x00')
+
+
+class TestDecompressDwarfSection(unittest.TestCase):
+    def test_zlib(self):
+        data = b'\x01\x02\x03' * 1000
+        compressed = (b'ZLIB' + struct.pack('>Q', len(data)) +
+                      zlib.compress(data))
+        section = DebugSectionDescriptor(
+            stream=BytesIO(compressed), name='.zdebug_info',
+            global_offset=0, size=len(compressed), address=0)
+        section = WasmFile._decompress_dwarf_section(section)
+        self.assertEqual(section.size, len(data))
+        self.assertEqual(section.stream.read(), data)
+
+    def test_zlib_bad_size(self):
+        data = b'\x01\x02\x03' * 1000
+        for size in (len(data) + 1, 2 ** 36, 2 ** 62, 2 ** 64 - 1):
+            compressed = (b'ZLIB' + struct.pack('>Q', size) +
+                          zlib.compress(data))
+            section = DebugSectionDescriptor(
+                stream=BytesIO(compressed), name='.zdebug_info',
+                global_offset=0, size=len(compressed), address=0)
+            with self.assertRaises(AssertionError) as cm:
+                WasmFile._decompress_dwarf_section(section)
+            self.assertEqual(
+                str(cm.exception),
+                'Wrong uncompressed size: expected %r, but got %r' % (
+                    size, len(data)))
+
+
+if __name__ == '__main__':
+    unittest.main()